@@ -1,19 +1,27 @@
 # bot.py
 import os
 import re
-import json
+import time
+import asyncio
 import logging
 from datetime import datetime, date
+from decimal import Decimal
+from functools import lru_cache
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
 from typing import Optional, Tuple, List
 
+import orjson
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from telegram import (
     Update,
     ReplyKeyboardMarkup,
     KeyboardButton,
 )
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     ApplicationBuilder,
     CommandHandler,
@@ -23,7 +31,7 @@ from telegram.ext import (
 )
 
 # Đảm bảo file google_sheet_store.py nằm cùng thư mục
-from google_sheet_store import append_expense, get_all_rows
+from google_sheet_store import append_expenses, get_all_rows
 
 # =========================
 # LOGGING
@@ -40,17 +48,31 @@ RENDER_EXTERNAL_URL = (os.getenv("RENDER_EXTERNAL_URL") or "").rstrip("/")
 WEBHOOK_PATH = "/webhook"
 WEBHOOK_URL = f"{RENDER_EXTERNAL_URL}{WEBHOOK_PATH}" if RENDER_EXTERNAL_URL else ""
 
+# Số giây giữ cache dữ liệu Google Sheet giữa các lần báo cáo
+ROWS_CACHE_TTL = float(os.getenv("ROWS_CACHE_TTL", "30"))
+# Số thread tối đa cho các lời gọi gspread (blocking HTTP)
+SHEETS_MAX_WORKERS = int(os.getenv("SHEETS_MAX_WORKERS", "8"))
+# Số update tối đa được xử lý đồng thời ở background
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "100"))
+
 if not BOT_TOKEN:
     raise RuntimeError("Missing TELEGRAM_BOT_TOKEN env var")
 
 # =========================
 # MENU
 # =========================
+BTN_THU = "➕ Ghi thu"
+BTN_CHI = "➖ Ghi chi"
+BTN_DAY = "📊 Tổng kết ngày"
+BTN_MONTH = "📅 Tổng kết tháng"
+BTN_YEAR = "📈 Tổng kết năm"
+BTN_HELP = "ℹ️ Help"
+
 MAIN_MENU = ReplyKeyboardMarkup(
     [
-        [KeyboardButton("➕ Ghi thu"), KeyboardButton("➖ Ghi chi")],
-        [KeyboardButton("📊 Tổng kết ngày"), KeyboardButton("📅 Tổng kết tháng")],
-        [KeyboardButton("📈 Tổng kết năm"), KeyboardButton("ℹ️ Help")],
+        [KeyboardButton(BTN_THU), KeyboardButton(BTN_CHI)],
+        [KeyboardButton(BTN_DAY), KeyboardButton(BTN_MONTH)],
+        [KeyboardButton(BTN_YEAR), KeyboardButton(BTN_HELP)],
     ],
     resize_keyboard=True
 )
@@ -106,72 +128,77 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # PARSE AMOUNT + SIGN
 # =========================
 # FIX: Thay đổi Regex để bắt được dấu + ở đầu dòng (?:^|\s)
-_AMOUNT_RE = re.compile(r"(?i)(?:^|\s)([+-]?)\s*(\d+(?:\.\d+)?)\s*([KM]?)\b")
+# Số có thể có dấu phẩy phân cách hàng nghìn (1,500K) — bỏ dấu phẩy khi quy đổi
+_AMOUNT_RE = re.compile(r"(?i)(?:^|\s)([+-]?)\s*(\d[\d,]*(?:\.\d+)?)\s*([KM]?)\b")
 
-def _parse_amount_with_sign(text: str) -> Tuple[int, Optional[str]]:
+def _split_amount(text: str) -> Tuple[int, Optional[str], str]:
     """
-    Returns (abs_amount_int, sign_char_or_None)
+    Returns (abs_amount_int, sign_char_or_None, rest_of_text)
     sign_char: '+', '-', or None if not explicitly provided.
+    rest_of_text: text with the first amount token removed (=> category).
+    Chỉ chạy regex 1 lần: phần còn lại được cắt theo vị trí match.
     """
-    s = text.upper().replace(",", "")
-    m = _AMOUNT_RE.search(s)
+    m = _AMOUNT_RE.search(text)
     if not m:
-        return 0, None
+        return 0, None, text.strip()
     sign = m.group(1) or None
-    num = float(m.group(2))
-    unit = (m.group(3) or "").upper()
+    raw = m.group(2).replace(",", "")
+    unit = m.group(3).upper()
 
     if unit == "K":
-        num *= 1_000
+        mult = 1_000
     elif unit == "M":
-        num *= 1_000_000
+        mult = 1_000_000
+    else:
+        mult = 1
 
-    amt = int(num)
-    if amt == 0:
-        return 0, sign
-    return abs(amt), sign
+    # Số nguyên (trường hợp phổ biến: 20K, 500K) tính thẳng bằng int.
+    # Số thập phân dùng Decimal: float làm sai số, VD int(2.01 * 1000) == 2009
+    if "." in raw:
+        amt = int(Decimal(raw) * mult)
+    else:
+        amt = int(raw) * mult
 
-def _strip_amount(text: str) -> str:
-    """Remove the first amount token from text to get category."""
-    # count=1 chỉ xóa 1 lần match đầu tiên
-    return _AMOUNT_RE.sub("", text, count=1).strip()
+    rest = (text[:m.start()] + text[m.end():]).strip()
+    return amt, sign, rest
 
 # =========================
 # PARSE LINES
 # =========================
-_DATE_PREFIX_RE = re.compile(r"^(\d{8})\s+(.*)$")
+@lru_cache(maxsize=512)
+def parse_yyyymmdd(s: str) -> Optional[date]:
+    """"YYYYMMDD" -> date, None nếu sai. Cache lại vì cùng 1 ngày hay lặp lại."""
+    try:
+        return datetime.strptime(s, "%Y%m%d").date()
+    except ValueError:
+        return None
 
 def parse_lines(text: str, fallback_mode: Optional[str]) -> List[Tuple[date, int, str]]:
     """
     Each line => (date, signed_amount, category)
     """
     results: List[Tuple[date, int, str]] = []
-    lines = [ln.strip() for ln in text.strip().splitlines() if ln.strip()]
+    lines = [ln for ln in map(str.strip, text.splitlines()) if ln]
+    today = datetime.today().date()  # tính 1 lần cho cả tin nhắn
 
     for line in lines:
-        # 1. Parse Date
-        m = _DATE_PREFIX_RE.match(line)
-        if m:
-            try:
-                d = datetime.strptime(m.group(1), "%Y%m%d").date()
-            except ValueError:
-                d = datetime.today().date() # Fallback if invalid date string
-            content = m.group(2).strip()
+        # 1. Parse Date: "YYYYMMDD<khoảng trắng>..." — cắt chuỗi thay vì chạy regex
+        if len(line) > 9 and line[:8].isdecimal() and line[8].isspace():
+            d = parse_yyyymmdd(line[:8]) or today # Fallback if invalid date string
+            content = line[9:].strip()
         else:
-            d = datetime.today().date()
+            d = today
             content = line
 
-        # 2. Parse Amount
-        abs_amt, sign = _parse_amount_with_sign(content)
+        # 2. Parse Amount (+ phần còn lại là Category)
+        abs_amt, sign, category = _split_amount(content)
         if abs_amt == 0:
             continue
 
         # 3. Parse Category
-        category = _strip_amount(content)
-        
         # FIX: Xóa các ký tự đặc biệt ở đầu để tránh lỗi #NAME? trong Excel
-        # Ví dụ: nếu còn sót "+ LUONG" -> thành "LUONG"
-        category = category.lstrip("+-= ").strip()
+        # Ví dụ: nếu còn sót "+ LUONG" -> thành "LUONG", "20K,CF" -> "CF"
+        category = category.lstrip("+-=, ").strip()
 
         if not category:
             continue
@@ -193,12 +220,126 @@ def parse_lines(text: str, fallback_mode: Optional[str]) -> List[Tuple[date, int
         results.append((d, int(amount), category))
     return results
 
+# =========================
+# BLOCKING I/O
+# =========================
+# gspread là thư viện đồng bộ: chạy trong thread pool để event loop vẫn xử lý
+# được update của user khác trong lúc chờ Google Sheets trả lời.
+_SHEETS_EXECUTOR = ThreadPoolExecutor(max_workers=SHEETS_MAX_WORKERS, thread_name_prefix="sheets")
+
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_SHEETS_EXECUTOR, func, *args)
+
+# =========================
+# ROWS CACHE
+# =========================
+# Mỗi lần báo cáo không cần gọi lại Google Sheets API: các lần bấm liên tiếp
+# trong ROWS_CACHE_TTL giây dùng chung 1 lần fetch (tiết kiệm quota 60 reads/min).
+# Kèm theo là các bảng tổng hợp sẵn [thu, chi] theo ngày, theo tháng và theo
+# (user, năm, tháng), dựng 1 lần khi fetch: báo cáo ngày/tháng chỉ còn 1 lần
+# tra dict, báo cáo năm đọc tối đa 12 ô thay vì quét toàn bộ lịch sử.
+# Danh sách dòng gốc không được giữ lại: báo cáo chỉ đọc các bảng tổng hợp.
+_ROWS_CACHE = {"ts": 0.0, "by_day": None, "by_month": None, "by_user_month": None}
+_ROWS_LOCK = asyncio.Lock()
+
+def _new_index() -> dict:
+    return {
+        "by_day": defaultdict(lambda: [0, 0]),         # "YYYY-MM-DD" -> [thu, chi]
+        "by_month": defaultdict(lambda: [0, 0]),       # (năm, tháng) -> [thu, chi]
+        "by_user_month": defaultdict(lambda: [0, 0]),  # (user, năm, tháng) -> [thu, chi]
+    }
+
+def _year_month(ds: str) -> Optional[Tuple[int, int]]:
+    """(năm, tháng) từ chuỗi "YYYY-MM-DD"; None nếu không phải ngày hợp lệ."""
+    # Đường nhanh: cắt chuỗi ISO cố định thay vì strptime cho từng dòng
+    if (
+        len(ds) == 10 and ds[4] == "-" and ds[7] == "-"
+        and ds[:4].isdecimal() and ds[5:7].isdecimal() and ds[8:].isdecimal()
+    ):
+        y, m = int(ds[:4]), int(ds[5:7])
+        try:
+            date(y, m, int(ds[8:]))  # loại ngày không tồn tại như strptime (vd 2026-02-31)
+        except ValueError:
+            return None
+        return y, m
+    try:
+        d = datetime.strptime(ds, "%Y-%m-%d")
+    except Exception:
+        return None
+    return d.year, d.month
+
+def _index_row(index: dict, ds: str, user: str, amt: int):
+    # amt đã là int (get_all_rows() ép kiểu 1 lần khi đọc sheet): không cần int()/abs() lại
+    if amt > 0:
+        slot = 0
+    else:
+        slot, amt = 1, -amt
+    index["by_day"][ds][slot] += amt
+    ym = _year_month(ds)
+    if ym is None:
+        return
+    index["by_month"][ym][slot] += amt
+    index["by_user_month"][(user,) + ym][slot] += amt
+
+async def _load_cache() -> dict:
+    # Đường nhanh không lấy lock: cache còn hạn thì trả luôn, báo cáo không phải
+    # chờ lần ghi Sheets đang giữ lock (chỉ thấy số liệu trước lần ghi đó)
+    if _ROWS_CACHE["by_day"] is not None and time.monotonic() - _ROWS_CACHE["ts"] < ROWS_CACHE_TTL:
+        return _ROWS_CACHE
+    async with _ROWS_LOCK:
+        # Kiểm tra lại bên trong lock để các request đồng thời chỉ fetch 1 lần
+        if _ROWS_CACHE["by_day"] is None or time.monotonic() - _ROWS_CACHE["ts"] >= ROWS_CACHE_TTL:
+            rows = await run_blocking(get_all_rows)
+            index = _new_index()
+            for r in rows:
+                _index_row(index, r["date"], r["user"] or "", r["amount"])
+            _ROWS_CACHE.update(index)
+            _ROWS_CACHE["ts"] = time.monotonic()
+        return _ROWS_CACHE
+
+async def _warm_cache():
+    # Chạy nền lúc khởi động: mở sheet + nạp cache trước khi user đầu tiên
+    # bấm báo cáo. Request đến trong lúc này sẽ chờ lock thay vì fetch lần 2.
+    try:
+        await _load_cache()
+        logger.info("Rows cache warmed")
+    except Exception as e:
+        logger.warning("Rows cache warm-up failed: %s", e)
+
+async def record_expenses(username: str, entries: List[Tuple[date, int, str]]):
+    """
+    Ghi các dòng (date, signed_amount, category) vào Google Sheet trong 1 request,
+    rồi write-through vào cache: báo cáo kế tiếp thấy ngay dòng mới mà không phải
+    fetch lại. Nếu cache đang trống thì lần đọc sau sẽ tự fetch.
+    Giữ _ROWS_LOCK suốt lúc ghi: không chen vào giữa 1 lần refresh đang chạy
+    (snapshot fetch trước khi ghi sẽ làm mất dòng mới, fetch sau khi ghi thì
+    cộng trùng). Ghi ít hơn đọc nhiều nên chờ lock ở đây chấp nhận được.
+    """
+    async with _ROWS_LOCK:
+        await run_blocking(
+            append_expenses,
+            [(d, username, int(amount), category) for d, amount, category in entries],
+        )
+        if _ROWS_CACHE["by_day"] is None:
+            return
+        for d, amount, _category in entries:
+            _index_row(_ROWS_CACHE, d.strftime("%Y-%m-%d"), username, int(amount))
+
 # =========================
 # SUMMARY HELPERS
 # =========================
 def _fmt_money(n: int) -> str:
     return f"{n:,}"
 
+def _fmt_totals(title: str, thu: int, chi: int) -> str:
+    return (
+        f"{title}\n"
+        f"💰 Thu: {_fmt_money(thu)}\n"
+        f"💸 Chi: {_fmt_money(chi)}\n"
+        f"📉 Còn: {_fmt_money(thu - chi)}"
+    )
+
 def _safe_username(update: Update) -> str:
     u = update.effective_user
     return (u.username or str(u.id))
@@ -208,38 +349,29 @@ def _safe_username(update: Update) -> str:
 # =========================
 async def summary_day(update: Update, context: ContextTypes.DEFAULT_TYPE, yyyymmdd: Optional[str] = None):
     if yyyymmdd:
-        try:
-            target = datetime.strptime(yyyymmdd, "%Y%m%d").date()
-        except Exception:
+        target = parse_yyyymmdd(yyyymmdd)
+        if target is None:
             await update.message.reply_text("❗ Sai định dạng ngày. Ví dụ: 20260101")
             return
     else:
         target = datetime.today().date()
 
-    rows = get_all_rows()
-    thu = chi = 0
-    for r in rows:
-        if r.get("date") == str(target):
-            amt = int(r.get("amount", 0))
-            if amt > 0:
-                thu += amt
-            else:
-                chi += abs(amt)
+    by_day = (await _load_cache())["by_day"]
+    thu, chi = by_day.get(str(target), (0, 0))
 
     await update.message.reply_text(
-        f"📊 TỔNG KẾT NGÀY ({target.strftime('%d/%m/%Y')})\n"
-        f"💰 Thu: {_fmt_money(thu)}\n"
-        f"💸 Chi: {_fmt_money(chi)}\n"
-        f"📉 Còn: {_fmt_money(thu - chi)}",
+        _fmt_totals(f"📊 TỔNG KẾT NGÀY ({target.strftime('%d/%m/%Y')})", thu, chi),
         reply_markup=MAIN_MENU
     )
 
 # =========================
 # SUMMARY MONTH (this month OR yyyymm)
 # =========================
+_YYYYMM_RE = re.compile(r"\d{6}")
+
 async def summary_month(update: Update, context: ContextTypes.DEFAULT_TYPE, yyyymm: Optional[str] = None):
     if yyyymm:
-        if not re.fullmatch(r"\d{6}", yyyymm):
+        if not _YYYYMM_RE.fullmatch(yyyymm):
             await update.message.reply_text("❗ Sai định dạng tháng. Ví dụ: 202601")
             return
         y = int(yyyymm[:4])
@@ -252,25 +384,11 @@ async def summary_month(update: Update, context: ContextTypes.DEFAULT_TYPE, yyyy
         now = datetime.today()
         target_year, target_month = now.year, now.month
 
-    rows = get_all_rows()
-    thu = chi = 0
-    for r in rows:
-        try:
-            d = datetime.strptime(r["date"], "%Y-%m-%d")
-        except Exception:
-            continue
-        if d.year == target_year and d.month == target_month:
-            amt = int(r.get("amount", 0))
-            if amt > 0:
-                thu += amt
-            else:
-                chi += abs(amt)
+    by_month = (await _load_cache())["by_month"]
+    thu, chi = by_month.get((target_year, target_month), (0, 0))
 
     await update.message.reply_text(
-        f"📅 TỔNG KẾT THÁNG ({target_month:02d}/{target_year})\n"
-        f"💰 Thu: {_fmt_money(thu)}\n"
-        f"💸 Chi: {_fmt_money(chi)}\n"
-        f"📉 Còn: {_fmt_money(thu - chi)}",
+        _fmt_totals(f"📅 TỔNG KẾT THÁNG ({target_month:02d}/{target_year})", thu, chi),
         reply_markup=MAIN_MENU
     )
 
@@ -299,44 +417,37 @@ async def summary_year(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(args) > 1 and requester == OWNER_USERNAME:
         target_user = args[1].replace("@", "").strip() or requester
 
-    rows = get_all_rows()
-    monthly = defaultdict(lambda: {"thu": 0, "chi": 0})
-
-    for r in rows:
-        if (r.get("user") or "") != target_user:
-            continue
-        try:
-            d = datetime.strptime(r["date"], "%Y-%m-%d")
-        except Exception:
-            continue
-        if d.year != year:
-            continue
-
-        amt = int(r.get("amount", 0))
-        if amt > 0:
-            monthly[d.month]["thu"] += amt
-        else:
-            monthly[d.month]["chi"] += abs(amt)
+    by_user_month = (await _load_cache())["by_user_month"]
+    # 2 mảng phẳng 13 ô (bỏ ô 0) đánh chỉ số theo tháng, thay cho dict lồng nhau
+    thu_m = [0] * 13
+    chi_m = [0] * 13
+    for m in range(1, 13):
+        bucket = by_user_month.get((target_user, year, m))
+        if bucket is not None:
+            thu_m[m], chi_m[m] = bucket
 
-    if not monthly:
+    months_with_data = [m for m in range(1, 13) if thu_m[m] != 0 or chi_m[m] != 0]
+    if not months_with_data:
         await update.message.reply_text(f"❌ Không có dữ liệu năm {year} cho @{target_user}.", reply_markup=MAIN_MENU)
         return
 
+    # 1 vòng duy nhất: cộng tổng, dựng dòng chi tiết và tìm tháng worst/best
+    # (so sánh > nghiêm ngặt: hoà thì giữ tháng sớm hơn)
     total_thu = total_chi = 0
     lines = []
-    for m in range(1, 13):
-        t = monthly[m]["thu"]
-        c = monthly[m]["chi"]
-        if t == 0 and c == 0:
-            continue
+    worst = best = months_with_data[0]
+    worst_chi = chi_m[worst]
+    best_con = thu_m[best] - chi_m[best]
+    for m in months_with_data:
+        t = thu_m[m]
+        c = chi_m[m]
         total_thu += t
         total_chi += c
         lines.append(f"• Tháng {m:02d}: Thu {_fmt_money(t)} | Chi {_fmt_money(c)} | Còn {_fmt_money(t - c)}")
-
-    # Worst/best month among months that have any data
-    months_with_data = [m for m in monthly.keys() if monthly[m]["thu"] != 0 or monthly[m]["chi"] != 0]
-    worst = max(months_with_data, key=lambda x: monthly[x]["chi"])
-    best = max(months_with_data, key=lambda x: monthly[x]["thu"] - monthly[x]["chi"])
+        if c > worst_chi:
+            worst, worst_chi = m, c
+        if t - c > best_con:
+            best, best_con = m, t - c
 
     # Evaluation line
     eval_line = "✅ Thu > Chi cả năm" if total_thu >= total_chi else "⚠️ Chi > Thu cả năm"
@@ -347,7 +458,7 @@ async def summary_year(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"💰 Tổng thu: {_fmt_money(total_thu)}\n"
         f"💸 Tổng chi: {_fmt_money(total_chi)}\n"
         f"📉 Còn lại: {_fmt_money(total_thu - total_chi)}\n\n"
-        f"📅 CHI TIẾT THEO THÁNG:\n" + ("\n".join(lines) if lines else "• (Không có dòng nào)") +
+        f"📅 CHI TIẾT THEO THÁNG:\n" + "\n".join(lines) +
         f"\n\n📌 ĐÁNH GIÁ:\n"
         f"{eval_line}\n"
         f"🔥 Tháng chi nhiều nhất: {worst:02d}\n"
@@ -358,43 +469,52 @@ async def summary_year(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # =========================
 # HANDLE TEXT (menu + input)
 # =========================
+_QUICK_DAY_RE = re.compile(r"(?i)(day|ngay)\s+(\d{8})")
+_QUICK_MONTH_RE = re.compile(r"(?i)(month|thang)\s+(\d{6})")
+
+_MODE_BY_BUTTON = {BTN_THU: "thu", BTN_CHI: "chi"}
+
+async def set_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data["mode"] = _MODE_BY_BUTTON[update.message.text.strip()]
+    await update.message.reply_text(
+        f"✍️ Đang ghi {'THU' if context.user_data['mode']=='thu' else 'CHI'}\n"
+        "Nhập nội dung (có thể nhiều dòng). Ví dụ:\n"
+        "• 20K CF\n"
+        "• 20260101 500K SPA\n"
+        "• +4M LUONG\n",
+        reply_markup=MAIN_MENU
+    )
+
+async def year_hint(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("📌 Gõ: /year 2026", reply_markup=MAIN_MENU)
+
+# Nút menu -> handler: 1 lần tra dict thay cho chuỗi if/elif so sánh từng nút
+_MENU_DISPATCH = {
+    BTN_THU: set_mode,
+    BTN_CHI: set_mode,
+    BTN_DAY: summary_day,
+    BTN_MONTH: summary_month,
+    BTN_YEAR: year_hint,
+    BTN_HELP: help_cmd,
+}
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (update.message.text or "").strip()
     if not text:
         return
 
     # Menu buttons
-    if text in ["➕ Ghi thu", "➖ Ghi chi"]:
-        context.user_data["mode"] = "thu" if "thu" in text else "chi"
-        await update.message.reply_text(
-            f"✍️ Đang ghi {'THU' if context.user_data['mode']=='thu' else 'CHI'}\n"
-            "Nhập nội dung (có thể nhiều dòng). Ví dụ:\n"
-            "• 20K CF\n"
-            "• 20260101 500K SPA\n"
-            "• +4M LUONG\n",
-            reply_markup=MAIN_MENU
-        )
-        return
-
-    if text in ["📊 Tổng kết ngày", "📅 Tổng kết tháng", "📈 Tổng kết năm"]:
-        if "năm" in text:
-            await update.message.reply_text("📌 Gõ: /year 2026", reply_markup=MAIN_MENU)
-        elif "tháng" in text:
-            await summary_month(update, context)
-        else:
-            await summary_day(update, context)
-        return
-
-    if text == "ℹ️ Help":
-        await help_cmd(update, context)
+    menu_handler = _MENU_DISPATCH.get(text)
+    if menu_handler:
+        await menu_handler(update, context)
         return
 
     # Special quick commands
-    m_day = re.fullmatch(r"(?i)(day|ngay)\s+(\d{8})", text)
+    m_day = _QUICK_DAY_RE.fullmatch(text)
     if m_day:
         await summary_day(update, context, m_day.group(2))
         return
-    m_month = re.fullmatch(r"(?i)(month|thang)\s+(\d{6})", text)
+    m_month = _QUICK_MONTH_RE.fullmatch(text)
     if m_month:
         await summary_month(update, context, m_month.group(2))
         return
@@ -416,37 +536,44 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     username = _safe_username(update)
-    ok = 0
-    errors = 0
 
-    for d, amount, category in entries:
-        try:
-            # FIX: Gọi đúng tham số date object
-            append_expense(d, username, int(amount), category)
-            ok += 1
-        except Exception as e:
-            errors += 1
-            logger.exception("append_expense failed: %s", e)
-
-    if errors == 0:
-        await update.message.reply_text(
-            f"✅ Ghi thành công: {ok} dòng\n"
-            f"👤 @{username}\n"
-            f"📌 Mẹo: Không có dấu +/− thì mặc định là CHI.",
-            reply_markup=MAIN_MENU
-        )
-    else:
+    try:
+        # 1 request cho cả tin nhắn nhiều dòng
+        await record_expenses(username, entries)
+    except Exception as e:
+        logger.exception("append_expenses failed: %s", e)
         await update.message.reply_text(
-            f"⚠️ Ghi được {ok} dòng, lỗi {errors} dòng.\n"
+            f"⚠️ Ghi thất bại {len(entries)} dòng.\n"
             f"Vui lòng xem Logs Render để biết chi tiết.",
             reply_markup=MAIN_MENU
         )
+        return
+
+    await update.message.reply_text(
+        f"✅ Ghi thành công: {len(entries)} dòng\n"
+        f"👤 @{username}\n"
+        f"📌 Mẹo: Không có dấu +/− thì mặc định là CHI.",
+        reply_markup=MAIN_MENU
+    )
 
 # =========================
 # BUILD TELEGRAM APPLICATION
 # =========================
 def build_application() -> Application:
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    # Giữ pool kết nối/timeout mặc định của PTB (pool 256 kết nối, dư cho
+    # MAX_CONCURRENT_UPDATES mặc định = 100)
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        # Update từ webhook được đẩy vào update_queue; PTB xử lý song song tối đa
+        # MAX_CONCURRENT_UPDATES update, và stop() chờ các update đang chạy xong
+        .concurrent_updates(MAX_CONCURRENT_UPDATES)
+        # Giới hạn tốc độ gửi theo quota Telegram: mặc định 30 msg/s toàn bot và
+        # 20 msg/phút mỗi group (chat riêng không bị giới hạn theo chat). Burst
+        # reply được xếp hàng; nếu vẫn dính 429 thì chờ retry_after và gửi lại 1 lần.
+        .rate_limiter(AIORateLimiter(max_retries=1))
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
@@ -456,38 +583,56 @@ def build_application() -> Application:
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
     return app
 
-application: Application = build_application()
-
 # =========================
 # FASTAPI (Render Web Service)
 # =========================
-fastapi_app = FastAPI()
-
-@fastapi_app.get("/")
-async def health():
-    return {"ok": True, "service": "telegram-finance-bot"}
-
-@fastapi_app.on_event("startup")
-async def on_startup():
-    await application.initialize()
-    await application.start()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Telegram Application nằm trên app.state thay vì biến global của module:
+    # webhook lấy qua request.app.state.tg
+    tg = build_application()
+    app.state.tg = tg
+    await tg.initialize()
+    await tg.start()
     logger.info("Application started")
 
     if WEBHOOK_URL:
-        await application.bot.set_webhook(url=WEBHOOK_URL, allowed_updates=Update.ALL_TYPES)
+        await tg.bot.set_webhook(url=WEBHOOK_URL, allowed_updates=[Update.MESSAGE])
         logger.info("Webhook set to %s", WEBHOOK_URL)
     else:
         logger.warning("RENDER_EXTERNAL_URL not set; webhook was not configured automatically.")
 
-@fastapi_app.on_event("shutdown")
-async def on_shutdown():
-    await application.stop()
-    await application.shutdown()
+    warm_task = asyncio.create_task(_warm_cache())
+
+    yield
+
+    warm_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await warm_task
+    # stop() xử lý nốt update còn trong queue và chờ các update đang chạy xong
+    await tg.stop()
+    await tg.shutdown()
+    # Chờ lời gọi gspread còn dở trong thread khác, không chặn event loop
+    await asyncio.get_running_loop().run_in_executor(None, _SHEETS_EXECUTOR.shutdown)
     logger.info("Application stopped")
 
+fastapi_app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+@fastapi_app.get("/")
+async def health():
+    return {"ok": True, "service": "telegram-finance-bot"}
+
 @fastapi_app.post(WEBHOOK_PATH)
 async def telegram_webhook(request: Request):
-    payload = await request.json()
-    update = Update.de_json(payload, application.bot)
-    await application.process_update(update)
+    payload = orjson.loads(await request.body())
+    # Bot chỉ xử lý tin nhắn văn bản: các loại update khác trả 200 luôn,
+    # không cần dựng Update và chạy qua chuỗi handler
+    message = payload.get("message")
+    if not message or "text" not in message:
+        return {"ok": True}
+    tg = request.app.state.tg
+    update = Update.de_json(payload, tg.bot)
+    # Trả 200 cho Telegram ngay; update (gọi Google Sheets...) được xử lý bởi
+    # vòng lặp update_queue mà tg.start() đã chạy, tg.stop() sẽ chờ xử lý xong
+    await tg.update_queue.put(update)
     return {"ok": True}
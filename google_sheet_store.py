@@ -1,13 +1,15 @@
+import os
+import threading
+
 import gspread
 from google.oauth2.service_account import Credentials
-from datetime import date
 
 # =====================
 # GOOGLE SHEETS CONFIG
 # =====================
 
-# ⚠️ Render Secret File được mount tại /etc/secrets/
-SERVICE_ACCOUNT_FILE = "/etc/secrets/service_account.json"
+# ⚠️ Render Secret File được mount tại /etc/secrets/ (chạy local: đặt biến môi trường SERVICE_ACCOUNT_FILE)
+SERVICE_ACCOUNT_FILE = os.getenv("SERVICE_ACCOUNT_FILE", "/etc/secrets/service_account.json")
 
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
@@ -21,30 +23,45 @@ SHEET_NAME = "Sheet1"
 # =====================
 # INIT CLIENT
 # =====================
-creds = Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE,
-    scopes=SCOPES
-)
+# Khởi tạo lười ở lần gọi đầu tiên (trong thread của executor) thay vì lúc
+# import: open_by_key + worksheet là 2 request HTTPS chặn, không nên làm chậm
+# cold start trước khi FastAPI kịp nhận request.
+_sheet = None
+_sheet_lock = threading.Lock()
 
-client = gspread.authorize(creds)
-sheet = client.open_by_key(SPREADSHEET_ID).worksheet(SHEET_NAME)
+def get_sheet():
+    global _sheet
+    if _sheet is None:
+        with _sheet_lock:
+            if _sheet is None:
+                creds = Credentials.from_service_account_file(
+                    SERVICE_ACCOUNT_FILE,
+                    scopes=SCOPES
+                )
+                client = gspread.authorize(creds)
+                _sheet = client.open_by_key(SPREADSHEET_ID).worksheet(SHEET_NAME)
+    return _sheet
 
 # =====================
-# APPEND EXPENSE
+# APPEND EXPENSES (BATCH)
 # =====================
-def append_expense(expense_date, user, amount, category):
+def append_expenses(entries):
     """
-    expense_date: datetime.date
-    user: telegram username
-    amount: int (+ thu, - chi)
-    category: string
+    entries: list of (expense_date, user, amount, category)
+    Ghi tất cả trong 1 request Sheets API (1 round-trip, 1 đơn vị quota)
+    thay vì append_row cho từng dòng.
     """
-    sheet.append_row(
+    if not entries:
+        return
+    get_sheet().append_rows(
         [
-            expense_date.strftime("%Y-%m-%d"),
-            user or "unknown",
-            int(amount),
-            category,
+            [
+                expense_date.strftime("%Y-%m-%d"),
+                user or "unknown",
+                int(amount),
+                category,
+            ]
+            for expense_date, user, amount, category in entries
         ],
         value_input_option="USER_ENTERED",
     )
@@ -62,20 +79,40 @@ def get_all_rows():
         category: string
     }
     """
-    records = sheet.get_all_records()
-    rows = []
+    # get_all_values() trả về list[list[str]] thô: không dựng dict cho
+    # từng dòng như get_all_records(), tự tra cột theo header 1 lần.
+    values = get_sheet().get_all_values()
+    if not values:
+        return []
 
-    for r in records:
+    header, *data = values
+    try:
+        i_date = header.index("date")
+        i_user = header.index("user")
+        i_amount = header.index("amount")
+        i_category = header.index("category")
+    except ValueError:
+        # Sheet chưa có header đúng định dạng
+        return []
+
+    rows = []
+    for row in data:
         try:
+            raw_amount = row[i_amount]
+            try:
+                amount = int(raw_amount)
+            except ValueError:
+                # Ô số thực (vd "1500.0") -> giữ hành vi int(float) cũ
+                amount = int(float(raw_amount))
             rows.append(
                 {
-                    "date": str(r.get("date")),
-                    "user": r.get("user"),
-                    "amount": int(r.get("amount")),
-                    "category": r.get("category"),
+                    "date": row[i_date],
+                    "user": row[i_user],
+                    "amount": amount,
+                    "category": row[i_category],
                 }
             )
-        except Exception:
+        except (ValueError, IndexError, OverflowError):
             # Bỏ qua dòng lỗi
             continue
 